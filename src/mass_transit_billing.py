@@ -2,11 +2,30 @@
 To run the program, use the following command from the src/ directory:
 
 python mass_transit_billing.py <zone_map_file> <journey_map_file> <output_file>
+    [--low-memory] [--bill-cache <bill_cache_file>]
 """
+import argparse
 import csv
-import sys
+import hashlib
+import heapq
+import io
+import json
+import os
+import stat
+import tempfile
+from array import array
 from collections import defaultdict
-from datetime import datetime
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import date, datetime
+from itertools import groupby, islice, repeat
+from operator import itemgetter
+
+# A user's journeys, stored as parallel columns of their zones, whether each
+# journey was IN (rather than OUT), and the ordinals of their days, in
+# ascending order of timestamp.
+JourneyColumns = tuple[array, array, array]
 
 
 class MassTransitBillingSystem:
@@ -21,23 +40,57 @@ class MassTransitBillingSystem:
     necessarily by users.
     """
 
+    # All amounts are stored in pence so that they can be added up exactly
+    # without rounding.
+    _BASE_FEE = 200
+    _MISSING_FEE = 500
+    _DAILY_CAP = 1500
+    _MONTHLY_CAP = 10000
+    # Additional cost of travelling to/from each zone, indexed by zone number.
+    # Index 0 is unused as zones start from 1, and the last entry applies to
+    # all zones from that number onwards.
+    _ZONE_COST = (None, 80, 50, 50, 30, 30, 10)
+    _MAX_ZONE_COST_INDEX = len(_ZONE_COST) - 1
+    # Included in the key of every cached bill, so that bills cached before a
+    # change in pricing aren't reused.
+    _PRICING_KEY = repr(
+        (_BASE_FEE, _MISSING_FEE, _DAILY_CAP, _MONTHLY_CAP, _ZONE_COST)
+    ).encode()
+    # Maximum number of journeys to sort in memory at once when reading the
+    # journey data one user at a time.
+    _SORT_CHUNK_SIZE = 1_000_000
+    # Size of the chunks of the journey data file to parse in parallel. Files
+    # smaller than two chunks, or read with only one CPU to use, are parsed in
+    # a single process.
+    _PARSE_CHUNK_BYTES = 64 * 1024 * 1024
+    # Minimum number of users before billing is split across processes, as
+    # below this the cost of starting the processes outweighs the speedup.
+    _PARALLEL_BILLING_MIN_USERS = 10_000
+
     def __init__(
-        self, zone_map_file: str, journey_data_file: str, output_file: str
+        self,
+        zone_map_file: str,
+        journey_data_file: str,
+        output_file: str,
+        bill_cache_file: str | None = None,
     ) -> None:
         self.zone_map_file = zone_map_file
         self.journey_data_file = journey_data_file
         self.output_file = output_file
-        # station_name: zone
+        # If set, bills are cached in this file between runs, so that users
+        # whose journeys haven't changed aren't billed again.
+        self.bill_cache_file = bill_cache_file
+        # station_name: zone (clamped to the last entry in the zone cost table)
         self.station_to_zone = {}
-        # user_id: [(zone, direction, timestamp), ...]
-        self.journeys_per_user = defaultdict(list)
-        # user_id: total_billing_amount
-        self.user_bills = defaultdict(float)
+        # user_id: ([zone, ...], [is_in, ...], [day, ...])
+        self.journeys_per_user = defaultdict(self.new_journey_columns)
+        # user_id: total_billing_amount (pence)
+        self.user_bills = defaultdict(int)
 
     @staticmethod
     def get_additional_zone_cost(zone: int) -> float:
         """
-        Get the additional cost of travelling to/from a given zone.
+        Get the additional cost (£) of travelling to/from a given zone.
 
         Args:
             zone: The zone to travel to/from.
@@ -47,14 +100,52 @@ class MassTransitBillingSystem:
         if zone <= 0:
             raise ValueError("Zone must be greater than or equal to 1.")
 
-        if zone == 1:
-            return 0.80
-        if 2 <= zone <= 3:
-            return 0.50
-        if 4 <= zone <= 5:
-            return 0.30
-        if zone >= 6:
-            return 0.10
+        return (
+            MassTransitBillingSystem._ZONE_COST[
+                min(zone, MassTransitBillingSystem._MAX_ZONE_COST_INDEX)
+            ]
+            / 100
+        )
+
+    @staticmethod
+    def format_amount(amount: int) -> str:
+        """
+        Format an amount in pence as pounds to two decimal places.
+
+        Args:
+            amount: The amount (pence) to format.
+
+        Returns:
+            The formatted amount (£), e.g. "6.90" for 690.
+        """
+        return f"{amount // 100}.{amount % 100:02d}"
+
+    @staticmethod
+    def get_num_workers() -> int:
+        """
+        Get the number of processes to split parallel work across.
+
+        Returns:
+            The number of CPUs that this process is allowed to run on.
+        """
+        # Respect the CPU affinity mask where the platform has one, so that a
+        # process pinned to some of the CPUs doesn't start a worker for each.
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+
+    @staticmethod
+    def new_journey_columns() -> JourneyColumns:
+        """
+        Create empty columns to store a user's journeys in.
+
+        Storing the journeys as compact arrays rather than a list of tuples
+        avoids allocating a tuple and several objects per journey.
+
+        Returns:
+            Empty zone, IN flag and day columns.
+        """
+        return array("H"), array("b"), array("l")
 
     def read_zone_map(self) -> None:
         """
@@ -66,90 +157,455 @@ class MassTransitBillingSystem:
             # Skip the header row.
             next(reader, None)
             for station, zone in reader:
-                self.station_to_zone[station] = int(zone)
+                zone = int(zone)
+                # Validate each zone once here, so that billing can look up the
+                # cost of the zones without checking them for every journey.
+                if zone <= 0:
+                    raise ValueError(
+                        f"Zone of station {station} must be greater than or "
+                        "equal to 1."
+                    )
+                # All zones from the last entry in the cost table onwards cost
+                # the same, so clamp them to it. This lets billing index the
+                # table directly and keeps the zones small enough to store
+                # compactly.
+                zone = min(zone, self._MAX_ZONE_COST_INDEX)
+                self.station_to_zone[station] = zone
+
+    @staticmethod
+    def get_journey_line_user_id(line: str) -> str:
+        """
+        Get the user ID from a line of journey data.
+
+        Args:
+            line: The line of journey data.
+
+        Returns:
+            The user ID, which is the first field of the line.
+        """
+        return line[: line.index(",")]
+
+    @staticmethod
+    def parse_journey_lines(
+        lines: Iterable[str],
+        station_to_zone: dict[str, int],
+        journeys_per_user: defaultdict[str, JourneyColumns],
+    ) -> None:
+        """
+        Parse lines of journey data and add each journey to the columns of its
+        user.
+
+        Args:
+            lines: The lines of journey data to parse, without the header row.
+            station_to_zone: A dictionary mapping each station to its zone.
+            journeys_per_user: A dictionary mapping each user to the columns of
+                their journeys, which the journeys are added to.
+        """
+        parse_date = date.fromisoformat
+        # As the data is sorted by timestamp, consecutive rows are usually on
+        # the same day, so only parse the date when it changes.
+        prev_day_str = None
+        day = None
+        for line in lines:
+            # None of the fields are quoted, so splitting each line on commas
+            # is faster than parsing it with csv.reader.
+            user_id, station, direction, timestamp = line.rstrip("\n").split(",")
+            # Only the day of the journey is needed for billing, so parse the
+            # fixed-width date prefix rather than the full timestamp, which
+            # isn't guaranteed to have a zero-padded hour. The day is stored as
+            # an ordinal so that billing can compare integers.
+            day_str = timestamp[:10]
+            if day_str != prev_day_str:
+                prev_day_str = day_str
+                day = parse_date(day_str).toordinal()
+            zones, is_in_flags, days = journeys_per_user[user_id]
+            zones.append(station_to_zone[station])
+            # Store the direction as a flag so that billing doesn't need to
+            # compare strings.
+            is_in_flags.append(direction == "IN")
+            days.append(day)
+
+    @staticmethod
+    def read_journey_data_range(
+        journey_data_file: str, start: int, end: int, station_to_zone: dict[str, int]
+    ) -> defaultdict[str, JourneyColumns]:
+        """
+        Read the journeys in a range of bytes of the journey data CSV file.
+
+        Args:
+            journey_data_file: The path to the journey data CSV file.
+            start: The offset of the first byte to read, which must be at the
+                start of a line after the header row.
+            end: The offset after the last byte to read, which must be at the
+                end of a line.
+            station_to_zone: A dictionary mapping each station to its zone.
+
+        Returns:
+            A dictionary mapping each user in the range to the columns of their
+            journeys.
+        """
+        with open(journey_data_file, "rb") as file:
+            file.seek(start)
+            data = file.read(end - start)
+        # Read the lines through a text wrapper, so that they're split in the
+        # same way as when the whole file is read in a single process.
+        lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8")
+        journeys_per_user = defaultdict(MassTransitBillingSystem.new_journey_columns)
+        MassTransitBillingSystem.parse_journey_lines(
+            lines, station_to_zone, journeys_per_user
+        )
+        return journeys_per_user
 
     def read_journey_data(self) -> None:
         """
         Read the CSV file containing the journey data and translate this into a
-        dictionary mapping each user to a list of their journeys.
+        dictionary mapping each user to the columns of their journeys.
         """
-        with open(self.journey_data_file, encoding="utf-8") as file:
-            reader = csv.reader(file)
+        # With a single CPU, the chunks would only be parsed one after another
+        # and copied back from the worker, so parse the file in this process.
+        file_size = os.path.getsize(self.journey_data_file)
+        num_workers = self.get_num_workers()
+        if file_size < 2 * self._PARSE_CHUNK_BYTES or num_workers <= 1:
+            with open(self.journey_data_file, encoding="utf-8") as file:
+                # Skip the header row.
+                next(file, None)
+                self.parse_journey_lines(
+                    file, self.station_to_zone, self.journeys_per_user
+                )
+            return
+
+        # Split the file into chunks which end at the end of a line, so that
+        # they can be parsed in parallel.
+        with open(self.journey_data_file, "rb") as file:
             # Skip the header row.
-            next(reader, None)
-            for user_id, station, direction, timestamp in reader:
-                # Convert the timestamp to a datetime object for ease of
-                # processing.
-                timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
-                self.journeys_per_user[user_id].append(
-                    (self.station_to_zone[station], direction, timestamp)
+            file.readline()
+            boundaries = [file.tell()]
+            while boundaries[-1] < file_size:
+                file.seek(boundaries[-1] + self._PARSE_CHUNK_BYTES)
+                file.readline()
+                boundaries.append(min(file.tell(), file_size))
+
+        # The chunks are merged in the order they appear in the file, so each
+        # user's journeys remain in ascending order of timestamp.
+        journeys_per_user = self.journeys_per_user
+        with ProcessPoolExecutor(num_workers) as executor:
+            for chunk_journeys_per_user in executor.map(
+                self.read_journey_data_range,
+                repeat(self.journey_data_file),
+                boundaries[:-1],
+                boundaries[1:],
+                repeat(self.station_to_zone),
+            ):
+                for user_id, journeys in chunk_journeys_per_user.items():
+                    if user_id not in journeys_per_user:
+                        journeys_per_user[user_id] = journeys
+                        continue
+                    for column, chunk_column in zip(
+                        journeys_per_user[user_id], journeys
+                    ):
+                        column.extend(chunk_column)
+
+    def read_journey_data_by_user(
+        self,
+    ) -> Iterator[tuple[str, JourneyColumns]]:
+        """
+        Read the CSV file containing the journey data and yield the journeys
+        for one user at a time, in ascending order of user ID.
+
+        Unlike read_journey_data(), this doesn't hold all the journeys in
+        memory at once. The journey data is sorted by user in fixed-size chunks
+        which are written to temporary files, and these are then merged so that
+        only one user's journeys need to be held in memory at a time. The final
+        chunk is merged straight from memory, so journey data that fits in a
+        single chunk is never written to disk.
+
+        Yields:
+            The user ID and the columns of their journeys.
+        """
+        get_user_id = self.get_journey_line_user_id
+        with tempfile.TemporaryDirectory() as temp_dir, ExitStack() as stack:
+            sorted_chunks = []
+            with open(self.journey_data_file, encoding="utf-8") as file:
+                # Skip the header row.
+                next(file, None)
+                while chunk := list(islice(file, self._SORT_CHUNK_SIZE)):
+                    # Make sure every line ends in a newline, so that the last
+                    # line of the file stays separate when written to a chunk.
+                    if not chunk[-1].endswith("\n"):
+                        chunk[-1] += "\n"
+                    # Python's sort is stable, so each user's journeys remain
+                    # in ascending order of timestamp.
+                    chunk.sort(key=get_user_id)
+                    if len(chunk) < self._SORT_CHUNK_SIZE:
+                        # This is the final chunk, so keep it in memory.
+                        sorted_chunks.append(chunk)
+                        break
+                    chunk_path = os.path.join(
+                        temp_dir, f"chunk_{len(sorted_chunks)}.csv"
+                    )
+                    with open(chunk_path, "w", encoding="utf-8") as chunk_file:
+                        chunk_file.writelines(chunk)
+                    sorted_chunks.append(
+                        stack.enter_context(open(chunk_path, encoding="utf-8"))
+                    )
+
+            # Ties are taken from the earlier chunk first, so merging the
+            # chunks also keeps each user's journeys in order of timestamp.
+            lines = heapq.merge(*sorted_chunks, key=get_user_id)
+            for user_id, user_lines in groupby(lines, key=get_user_id):
+                journeys_per_user = defaultdict(self.new_journey_columns)
+                self.parse_journey_lines(
+                    user_lines, self.station_to_zone, journeys_per_user
                 )
+                yield user_id, journeys_per_user[user_id]
+
+    @staticmethod
+    def calculate_user_bill(journeys: JourneyColumns) -> int:
+        """
+        Calculate the total amount a user owes by aggregating the cost of their
+        journeys.
+
+        Args:
+            journeys: The columns of the user's journeys.
+
+        Returns:
+            The total billing amount (pence) for the user.
+        """
+        # Look up the zone costs directly rather than through
+        # get_additional_zone_cost(), as the zones have already been validated
+        # and clamped by read_zone_map() and this is the hot loop.
+        zone_costs = MassTransitBillingSystem._ZONE_COST
+        base_fee = MassTransitBillingSystem._BASE_FEE
+        missing_fee = MassTransitBillingSystem._MISSING_FEE
+        daily_cap = MassTransitBillingSystem._DAILY_CAP
+        monthly_cap = MassTransitBillingSystem._MONTHLY_CAP
+        zones, is_in_flags, days = journeys
+
+        # Store the additional cost of the entry zone of each of the day's
+        # journeys in a stack so that we can find the matching IN journey for
+        # each OUT journey. A list with bound append/pop methods is faster in
+        # CPython than a preallocated array with a separate top index.
+        daily_entry_costs = []
+        push_entry_cost = daily_entry_costs.append
+        pop_entry_cost = daily_entry_costs.pop
+        # Keep track of daily and monthly totals, as these are capped at £15
+        # and £100 respectively.
+        daily_total = 0
+        monthly_total = 0
+        # Track the current day to determine when to reset the daily total.
+        cur_day = days[0]
+
+        for zone, is_in, day in zip(zones, is_in_flags, days):
+            if is_in:
+                push_entry_cost(zone_costs[zone])
+            # Otherwise, it's an OUT journey, so calculate the cost of the
+            # journey based on the last IN journey and the current OUT journey:
+            # a £2 base fee, plus additional costs based on the entry and exit
+            # zones.
+            elif daily_entry_costs:
+                daily_total += base_fee + pop_entry_cost() + zone_costs[zone]
+            # If the user does not have a matching IN journey, then they must
+            # be charged a missing fee of £5.
+            else:
+                daily_total += missing_fee
+
+            # If a new day has started, update it, update the running total for
+            # the month, and reset the daily total.
+            if day > cur_day:
+                cur_day = day
+                monthly_total += min(daily_cap, daily_total)
+                daily_total = 0
+                # Costs are never negative, so once the monthly cap has been
+                # reached, the rest of the journeys can't change the bill.
+                if monthly_total >= monthly_cap:
+                    return monthly_cap
+
+        # The user has not exited all stations they entered, so charge them a
+        # missing fee of £5 per day.
+        if daily_entry_costs:
+            daily_total += missing_fee * len(daily_entry_costs)
+        monthly_total += min(daily_cap, daily_total)
+
+        # There's a monthly cap of £100.
+        return min(monthly_cap, monthly_total)
+
+    @staticmethod
+    def calculate_user_bills(
+        users: list[tuple[str, JourneyColumns]],
+    ) -> dict[str, int]:
+        """
+        Calculate the total amount each of the given users owes.
+
+        Args:
+            users: The user IDs and the columns of their journeys.
+
+        Returns:
+            A dictionary mapping each user ID to their billing amount (pence).
+        """
+        calculate_user_bill = MassTransitBillingSystem.calculate_user_bill
+        return {user_id: calculate_user_bill(journeys) for user_id, journeys in users}
+
+    def bill_users(self, users: list[tuple[str, JourneyColumns]]) -> dict[str, int]:
+        """
+        Calculate the total amount each of the given users owes, splitting the
+        users across processes if there are enough of them and more than one
+        CPU to use.
+
+        Args:
+            users: The user IDs and the columns of their journeys.
+
+        Returns:
+            A dictionary mapping each user ID to their billing amount (pence).
+        """
+        # With a single CPU, the users would only be copied to one worker and
+        # back, so bill them in this process instead.
+        num_workers = self.get_num_workers()
+        if len(users) < self._PARALLEL_BILLING_MIN_USERS or num_workers <= 1:
+            return self.calculate_user_bills(users)
+
+        # Each user's bill is independent of the others, so split the users
+        # evenly between one process per CPU.
+        chunk_size = -(-len(users) // num_workers)
+        user_chunks = [
+            users[i : i + chunk_size] for i in range(0, len(users), chunk_size)
+        ]
+        user_bills = {}
+        with ProcessPoolExecutor(num_workers) as executor:
+            for chunk_bills in executor.map(self.calculate_user_bills, user_chunks):
+                user_bills.update(chunk_bills)
+        return user_bills
 
     def calculate_billing_amounts_per_user(self) -> None:
         """
         Calculate the total amount each user owes by aggregating the cost of
         their journeys.
         """
-        for user_id, journeys in self.journeys_per_user.items():
-            # Store the daily journeys in a stack so that we can find the
-            # matching IN journey for each OUT journey.
-            daily_journeys = []
-            # Keep track of daily and monthly totals, as these are capped at
-            # £15 and £100 respectively.
-            daily_total = 0.00
-            monthly_total = 0.00
-            # Track the current day to determine when to reset the daily total.
-            cur_day = journeys[0][2].date()
-
-            for zone, direction, timestamp in journeys:
-                if direction == "IN":
-                    daily_journeys.append(zone)
-                # If the user does not have a matching IN journey, then they
-                # must be charged a missing fee of £5.
-                elif direction == "OUT" and not daily_journeys:
-                    daily_total += 5.00
-                # Otherwise, calculate the cost of the journey based on the
-                # last IN journey and the current OUT journey.
-                elif direction == "OUT":
-                    entry_zone = daily_journeys.pop()
-                    # £2 base fee for all journeys, plus additional costs based
-                    # on the entry and exit zones.
-                    journey_cost = (
-                        2.0
-                        + self.get_additional_zone_cost(entry_zone)
-                        + self.get_additional_zone_cost(zone)
-                    )
-                    daily_total += round(journey_cost, 2)
+        users = list(self.journeys_per_user.items())
+        if self.bill_cache_file is None:
+            self.user_bills.update(self.bill_users(users))
+            return
 
-                # If a new day has started, update it, update the running total
-                # for the month, and reset the daily total.
-                if timestamp.date() > cur_day:
-                    cur_day = timestamp.date()
-                    monthly_total += min(15.00, daily_total)
-                    daily_total = 0.00
+        # Reuse the bills from the previous run for any users whose journeys
+        # haven't changed, and only bill the rest.
+        cached_bills = self.read_bill_cache()
+        journeys_keys = {
+            user_id: self.get_journeys_key(journeys) for user_id, journeys in users
+        }
+        uncached_users = []
+        for user_id, journeys in users:
+            bill_amount = cached_bills.get(journeys_keys[user_id])
+            if bill_amount is None:
+                uncached_users.append((user_id, journeys))
+            else:
+                self.user_bills[user_id] = bill_amount
+        self.user_bills.update(self.bill_users(uncached_users))
 
-            # The user has not exited all stations they entered, so charge them
-            # a missing fee of £5 per day.
-            if daily_journeys:
-                daily_total += round(5.00 * len(daily_journeys), 2)
-            monthly_total += round(min(15.00, daily_total), 2)
+        self.write_bill_cache(
+            {
+                journeys_key: self.user_bills[user_id]
+                for user_id, journeys_key in journeys_keys.items()
+            }
+        )
 
-            # There's a monthly cap of £100.
-            self.user_bills[user_id] = min(100.00, monthly_total)
+    @staticmethod
+    def get_journeys_key(journeys: JourneyColumns) -> str:
+        """
+        Get a key that identifies a user's journeys, for caching their bill.
+
+        Args:
+            journeys: The columns of the user's journeys.
+
+        Returns:
+            A digest of the journeys and the current pricing.
+        """
+        hasher = hashlib.blake2b(MassTransitBillingSystem._PRICING_KEY, digest_size=16)
+        for column in journeys:
+            hasher.update(column.tobytes())
+        return hasher.hexdigest()
+
+    def read_bill_cache(self) -> dict[str, int]:
+        """
+        Read the bills cached by the previous run.
+
+        Returns:
+            A dictionary mapping each journeys key to its billing amount
+            (pence), which is empty if there is no cache yet or it can't be
+            decoded.
+        """
+        try:
+            with open(self.bill_cache_file, encoding="utf-8") as file:
+                bills = json.load(file)
+        except FileNotFoundError:
+            return {}
+        # A corrupt cache only means that every user has to be billed again,
+        # so don't let it stop the billing.
+        except ValueError:
+            return {}
+        if not isinstance(bills, dict):
+            return {}
+        # Drop any bills which aren't a whole number of pence, rather than
+        # failing when they're formatted. JSON true and false decode as bools,
+        # which are ints, so check the exact type.
+        return {
+            journeys_key: amount
+            for journeys_key, amount in bills.items()
+            if type(amount) is int
+        }
+
+    def write_bill_cache(self, bills: dict[str, int]) -> None:
+        """
+        Write the bills for this run to the cache, replacing any previous
+        cache so that it only holds bills for the current journey data.
+
+        Args:
+            bills: A dictionary mapping each journeys key to its billing amount
+                (pence).
+        """
+        # Write to a temporary file first and then replace the cache with it,
+        # so that an interrupted write can't leave a partially written cache.
+        cache_dir = os.path.dirname(os.path.abspath(self.bill_cache_file))
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=cache_dir, suffix=".tmp", delete=False
+        ) as file:
+            temp_path = file.name
+            try:
+                # The temporary file is only readable by its owner, so give it
+                # the mode of the existing cache, or the default mode for a new
+                # file, as os.replace() keeps the mode of the temporary file.
+                try:
+                    mode = stat.S_IMODE(os.stat(self.bill_cache_file).st_mode)
+                except FileNotFoundError:
+                    umask = os.umask(0)
+                    os.umask(umask)
+                    mode = 0o666 & ~umask
+                os.chmod(temp_path, mode)
+                json.dump(bills, file)
+            except BaseException:
+                file.close()
+                os.remove(temp_path)
+                raise
+        os.replace(temp_path, self.bill_cache_file)
 
     def write_billing_output(self) -> None:
         """
         Write the billing output to a CSV file, with each line containing the
         user ID and their billing amount (£).
         """
+        format_amount = self.format_amount
         with open(self.output_file, "w", encoding="utf-8") as file:
-            writer = csv.writer(file)
-            # Write the billing output in ascending order of user ID.
-            for user_id, bill_amount in sorted(self.user_bills.items()):
-                # Format the billing amount to two decimal places, as we store
-                # the amount in £.
-                formatted_amount = format(bill_amount, ".2f")
-                writer.writerow([user_id, formatted_amount])
+            # Each row is only a user ID and an amount, so build the whole
+            # output up front and write it at once rather than going through
+            # csv.writer for every row. The billing output is written in
+            # ascending order of user ID, and the billing amount is formatted
+            # in £, as we store the amount in pence. User IDs are unique, so
+            # sort on them alone rather than comparing (user_id, amount) pairs.
+            user_bills = sorted(self.user_bills.items(), key=itemgetter(0))
+            file.write(
+                "".join(
+                    f"{user_id},{format_amount(bill_amount)}\n"
+                    for user_id, bill_amount in user_bills
+                )
+            )
 
         print(
             f"Successfully wrote billing output to {self.output_file} at "
@@ -165,8 +621,67 @@ class MassTransitBillingSystem:
         self.calculate_billing_amounts_per_user()
         self.write_billing_output()
 
+    def process_billing_streaming(self) -> None:
+        """
+        Process the billing for the transactions in the transit system, one
+        user at a time.
+
+        This produces the same output as process_billing(), but only holds a
+        single user's journeys in memory at a time, so it can be used for
+        journey data that is too large to fit in memory.
+
+        If a bill cache file is set, the previous and new caches are held in
+        memory with one entry per user, so memory use grows with the number of
+        users (though not with the number of journeys).
+        """
+        self.read_zone_map()
+        use_bill_cache = self.bill_cache_file is not None
+        cached_bills = self.read_bill_cache() if use_bill_cache else {}
+        bills = {}
+        with open(self.output_file, "w", encoding="utf-8") as file:
+            # The journeys are read in ascending order of user ID, so the
+            # billing output can be written as soon as each user is billed.
+            for user_id, journeys in self.read_journey_data_by_user():
+                if use_bill_cache:
+                    journeys_key = self.get_journeys_key(journeys)
+                    bill_amount = cached_bills.get(journeys_key)
+                    if bill_amount is None:
+                        bill_amount = self.calculate_user_bill(journeys)
+                    bills[journeys_key] = bill_amount
+                else:
+                    bill_amount = self.calculate_user_bill(journeys)
+                file.write(f"{user_id},{self.format_amount(bill_amount)}\n")
+
+        if use_bill_cache:
+            self.write_bill_cache(bills)
+
+        print(
+            f"Successfully wrote billing output to {self.output_file} at "
+            f"{datetime.now()}"
+        )
+
 
 if __name__ == "__main__":
-    zone_map, journey_data, output = sys.argv[1:]
-    billing_system = MassTransitBillingSystem(zone_map, journey_data, output)
-    billing_system.process_billing()
+    parser = argparse.ArgumentParser(
+        description="Bill the users of a mass transit system for their journeys."
+    )
+    parser.add_argument("zone_map_file")
+    parser.add_argument("journey_data_file")
+    parser.add_argument("output_file")
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="bill one user at a time, for journey data that doesn't fit in memory",
+    )
+    parser.add_argument(
+        "--bill-cache",
+        help="file to cache bills in, so unchanged users aren't billed again",
+    )
+    args = parser.parse_args()
+    billing_system = MassTransitBillingSystem(
+        args.zone_map_file, args.journey_data_file, args.output_file, args.bill_cache
+    )
+    if args.low_memory:
+        billing_system.process_billing_streaming()
+    else:
+        billing_system.process_billing()
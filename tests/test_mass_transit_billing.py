@@ -4,8 +4,12 @@ To run the program, use the following command from the tests/ directory:
 pytest
 """
 
+import os
+import stat
 import tempfile
-from datetime import datetime
+from array import array
+from datetime import date
+from pathlib import Path
 
 import pytest
 
@@ -73,6 +77,18 @@ class TestMassTransitBillingSystem:
         with pytest.raises(TypeError):
             sample_billing_system.get_additional_zone_cost({})
 
+    def test_format_amount(self, sample_billing_system: MassTransitBillingSystem):
+        """
+        Ensure that amounts in pence are formatted correctly in pounds.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+        """
+        assert sample_billing_system.format_amount(0) == "0.00"
+        assert sample_billing_system.format_amount(5) == "0.05"
+        assert sample_billing_system.format_amount(690) == "6.90"
+        assert sample_billing_system.format_amount(10000) == "100.00"
+
     def test_read_zone_map(self, sample_billing_system: MassTransitBillingSystem):
         """
         Ensure that the map of station to zone number is read correctly.
@@ -88,6 +104,57 @@ class TestMassTransitBillingSystem:
             "station4": 4,
         }
 
+    def test_read_zone_map_errors(
+        self, sample_billing_system: MassTransitBillingSystem, tmp_path: Path
+    ):
+        """
+        Ensure that invalid zone numbers in the zone map raise the correct
+        errors.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            tmp_path: A temporary directory for the invalid zone map.
+        """
+        zone_map_file = tmp_path / "invalid_zone_map.csv"
+        zone_map_file.write_text("station,zone\nstation1,0\n", encoding="utf-8")
+        sample_billing_system.zone_map_file = str(zone_map_file)
+        with pytest.raises(ValueError):
+            sample_billing_system.read_zone_map()
+
+    def test_process_billing_with_outer_zones(
+        self, sample_billing_system: MassTransitBillingSystem, tmp_path: Path
+    ):
+        """
+        Ensure that zones from 6 onwards, including zones too large to store
+        unclamped, are all billed at the outer zone cost.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            tmp_path: A temporary directory for the zone map and journey data.
+        """
+        zone_map_file = tmp_path / "zone_map.csv"
+        zone_map_file.write_text(
+            "station,zone\nstation6,6\nstation70000,70000\n", encoding="utf-8"
+        )
+        journey_data_file = tmp_path / "journey_data.csv"
+        journey_data_file.write_text(
+            "user_id,station,direction,time\n"
+            "user1,station6,IN,2022-04-04T09:40:00\n"
+            "user1,station70000,OUT,2022-04-04T10:40:00\n",
+            encoding="utf-8",
+        )
+        sample_billing_system.zone_map_file = str(zone_map_file)
+        sample_billing_system.journey_data_file = str(journey_data_file)
+        sample_billing_system.read_zone_map()
+        assert sample_billing_system.station_to_zone == {
+            "station6": 6,
+            "station70000": 6,
+        }
+        sample_billing_system.read_journey_data()
+        sample_billing_system.calculate_billing_amounts_per_user()
+        # zone 6 -> zone 70000 = 2.00 + 0.10 + 0.10 = £2.20
+        assert dict(sample_billing_system.user_bills) == {"user1": 220}
+
     def test_read_journey_data(self, sample_billing_system: MassTransitBillingSystem):
         """
         Ensure that journey data is read correctly.
@@ -95,28 +162,199 @@ class TestMassTransitBillingSystem:
         Args:
             sample_billing_system: A sample billing system object.
         """
+        # Days are stored as ordinals.
+        apr_4, apr_6, apr_7, apr_10 = (
+            date(2022, 4, day).toordinal() for day in (4, 6, 7, 10)
+        )
         sample_billing_system.read_zone_map()
         sample_billing_system.read_journey_data()
+        # Directions are stored as 1 for IN and 0 for OUT.
         assert dict(sample_billing_system.journeys_per_user) == {
-            "user1": [
-                (1, "IN", datetime(2022, 4, 4, 9, 40)),
-                (3, "OUT", datetime(2022, 4, 4, 13, 55)),
-                (1, "IN", datetime(2022, 4, 7, 9, 40)),
-                (1, "OUT", datetime(2022, 4, 7, 9, 45)),
-            ],
-            "user2": [
-                (3, "IN", datetime(2022, 4, 4, 9, 50)),
-                (1, "OUT", datetime(2022, 4, 4, 10, 50)),
-            ],
-            "user3": [
-                (4, "IN", datetime(2022, 4, 6, 5, 10)),
-                (2, "OUT", datetime(2022, 4, 6, 7, 40)),
-                # As they tapped out but not in, this journey should cause
-                # a £5 missing tap charge.
-                (2, "OUT", datetime(2022, 4, 10, 7, 40)),
-            ],
+            "user1": (
+                array("H", [1, 3, 1, 1]),
+                array("b", [1, 0, 1, 0]),
+                array("l", [apr_4, apr_4, apr_7, apr_7]),
+            ),
+            "user2": (
+                array("H", [3, 1]),
+                array("b", [1, 0]),
+                array("l", [apr_4, apr_4]),
+            ),
+            # As they tapped out but not in on 2022-04-10, this journey should
+            # cause a £5 missing tap charge.
+            "user3": (
+                array("H", [4, 2, 2]),
+                array("b", [1, 0, 0]),
+                array("l", [apr_6, apr_6, apr_10]),
+            ),
         }
 
+    def test_read_journey_data_in_parallel(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        """
+        Ensure that journey data is read the same way when it's split into
+        chunks which are parsed in parallel.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the parse chunk size and the
+                number of workers.
+        """
+        sample_billing_system.read_zone_map()
+        sample_billing_system.read_journey_data()
+        expected_journeys_per_user = dict(sample_billing_system.journeys_per_user)
+
+        monkeypatch.setattr(MassTransitBillingSystem, "_PARSE_CHUNK_BYTES", 50)
+        monkeypatch.setattr(
+            MassTransitBillingSystem, "get_num_workers", staticmethod(lambda: 2)
+        )
+        sample_billing_system.journeys_per_user.clear()
+        sample_billing_system.read_journey_data()
+        assert (
+            dict(sample_billing_system.journeys_per_user) == expected_journeys_per_user
+        )
+
+    def test_read_journey_data_with_one_worker(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        """
+        Ensure that journey data is parsed in a single process when there's
+        only one CPU to use, however large the file is.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the parse chunk size, the
+                number of workers and the process pool.
+        """
+
+        def fail_to_start_process_pool(*args, **kwargs):
+            raise AssertionError("Journeys should have been parsed in this process.")
+
+        sample_billing_system.read_zone_map()
+        sample_billing_system.read_journey_data()
+        expected_journeys_per_user = dict(sample_billing_system.journeys_per_user)
+
+        monkeypatch.setattr(MassTransitBillingSystem, "_PARSE_CHUNK_BYTES", 50)
+        monkeypatch.setattr(
+            MassTransitBillingSystem, "get_num_workers", staticmethod(lambda: 1)
+        )
+        monkeypatch.setattr(
+            "src.mass_transit_billing.ProcessPoolExecutor", fail_to_start_process_pool
+        )
+        sample_billing_system.journeys_per_user.clear()
+        sample_billing_system.read_journey_data()
+        assert (
+            dict(sample_billing_system.journeys_per_user) == expected_journeys_per_user
+        )
+
+    def test_read_journey_data_with_unicode_line_separators(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ):
+        """
+        Ensure that names containing characters which str.splitlines() treats
+        as line breaks are read the same way by every journey data reader.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the parse chunk size and the
+                number of workers.
+            tmp_path: A temporary directory for the zone map and journey data.
+        """
+        zone_map_file = tmp_path / "zone_map.csv"
+        zone_map_file.write_text(
+            "station,zone\nstation\u2028a,1\nstation\x85b,2\n", encoding="utf-8"
+        )
+        journey_data_file = tmp_path / "journey_data.csv"
+        journey_data_file.write_text(
+            "user_id,station,direction,time\n"
+            "user\x1c1,station\u2028a,IN,2022-04-04T09:40:00\n"
+            "user\x1c1,station\x85b,OUT,2022-04-04T10:40:00\n",
+            encoding="utf-8",
+        )
+        sample_billing_system.zone_map_file = str(zone_map_file)
+        sample_billing_system.journey_data_file = str(journey_data_file)
+        sample_billing_system.read_zone_map()
+        expected_journeys_per_user = {
+            "user\x1c1": (
+                array("H", [1, 2]),
+                array("b", [1, 0]),
+                array("l", [date(2022, 4, 4).toordinal()] * 2),
+            )
+        }
+
+        sample_billing_system.read_journey_data()
+        assert (
+            dict(sample_billing_system.journeys_per_user) == expected_journeys_per_user
+        )
+        assert (
+            dict(sample_billing_system.read_journey_data_by_user())
+            == expected_journeys_per_user
+        )
+
+        monkeypatch.setattr(MassTransitBillingSystem, "_PARSE_CHUNK_BYTES", 40)
+        monkeypatch.setattr(
+            MassTransitBillingSystem, "get_num_workers", staticmethod(lambda: 2)
+        )
+        sample_billing_system.journeys_per_user.clear()
+        sample_billing_system.read_journey_data()
+        assert (
+            dict(sample_billing_system.journeys_per_user) == expected_journeys_per_user
+        )
+
+    def test_read_journey_data_by_user(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        """
+        Ensure that journey data is read correctly one user at a time, even
+        when it has to be sorted in multiple chunks.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the sort chunk size.
+        """
+        monkeypatch.setattr(MassTransitBillingSystem, "_SORT_CHUNK_SIZE", 2)
+        # Days are stored as ordinals.
+        apr_4, apr_6, apr_7, apr_10 = (
+            date(2022, 4, day).toordinal() for day in (4, 6, 7, 10)
+        )
+        sample_billing_system.read_zone_map()
+        assert list(sample_billing_system.read_journey_data_by_user()) == [
+            (
+                "user1",
+                (
+                    array("H", [1, 3, 1, 1]),
+                    array("b", [1, 0, 1, 0]),
+                    array("l", [apr_4, apr_4, apr_7, apr_7]),
+                ),
+            ),
+            (
+                "user2",
+                (
+                    array("H", [3, 1]),
+                    array("b", [1, 0]),
+                    array("l", [apr_4, apr_4]),
+                ),
+            ),
+            (
+                "user3",
+                (
+                    array("H", [4, 2, 2]),
+                    array("b", [1, 0, 0]),
+                    array("l", [apr_6, apr_6, apr_10]),
+                ),
+            ),
+        ]
+
     def test_calculate_billing_amounts_per_user(
         self, sample_billing_system: MassTransitBillingSystem
     ):
@@ -129,12 +367,250 @@ class TestMassTransitBillingSystem:
         sample_billing_system.read_zone_map()
         sample_billing_system.read_journey_data()
         sample_billing_system.calculate_billing_amounts_per_user()
+        # Billing amounts are stored in pence.
         assert dict(sample_billing_system.user_bills) == {
-            "user1": 6.90,
-            "user2": 3.30,
-            "user3": 7.80,
+            "user1": 690,
+            "user2": 330,
+            "user3": 780,
         }
 
+    def test_calculate_user_bill_caps(
+        self, sample_billing_system: MassTransitBillingSystem
+    ):
+        """
+        Ensure that the daily and monthly caps are applied to a user's bill.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+        """
+        # Three OUT journeys without a matching IN journey on each of 8 days
+        # cost £15 per day, as the daily cap is reached, which is £120 in
+        # total, so the monthly cap of £100 is applied.
+        num_days = 8
+        journeys = (
+            array("H", [1] * 3 * num_days),
+            array("b", [0] * 3 * num_days),
+            array("l", [day for day in range(num_days) for _ in range(3)]),
+        )
+        assert sample_billing_system.calculate_user_bill(journeys) == 10000
+
+    def test_calculate_billing_amounts_per_user_in_parallel(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        """
+        Ensure that the billing amounts per user are calculated correctly when
+        the users are split across multiple processes.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the parallel billing threshold
+                and the number of workers.
+        """
+        monkeypatch.setattr(MassTransitBillingSystem, "_PARALLEL_BILLING_MIN_USERS", 0)
+        monkeypatch.setattr(
+            MassTransitBillingSystem, "get_num_workers", staticmethod(lambda: 2)
+        )
+        sample_billing_system.read_zone_map()
+        sample_billing_system.read_journey_data()
+        sample_billing_system.calculate_billing_amounts_per_user()
+        # Billing amounts are stored in pence.
+        assert dict(sample_billing_system.user_bills) == {
+            "user1": 690,
+            "user2": 330,
+            "user3": 780,
+        }
+
+    def test_calculate_billing_amounts_per_user_with_one_worker(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        """
+        Ensure that the users are billed in a single process when there's only
+        one CPU to use, however many users there are.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the parallel billing threshold,
+                the number of workers and the process pool.
+        """
+
+        def fail_to_start_process_pool(*args, **kwargs):
+            raise AssertionError("Users should have been billed in this process.")
+
+        monkeypatch.setattr(MassTransitBillingSystem, "_PARALLEL_BILLING_MIN_USERS", 0)
+        monkeypatch.setattr(
+            MassTransitBillingSystem, "get_num_workers", staticmethod(lambda: 1)
+        )
+        monkeypatch.setattr(
+            "src.mass_transit_billing.ProcessPoolExecutor", fail_to_start_process_pool
+        )
+        sample_billing_system.read_zone_map()
+        sample_billing_system.read_journey_data()
+        sample_billing_system.calculate_billing_amounts_per_user()
+        # Billing amounts are stored in pence.
+        assert dict(sample_billing_system.user_bills) == {
+            "user1": 690,
+            "user2": 330,
+            "user3": 780,
+        }
+
+    def test_calculate_billing_amounts_per_user_with_bill_cache(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ):
+        """
+        Ensure that cached bills are reused when the journeys haven't changed.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the bill calculation.
+            tmp_path: A temporary directory for the bill cache.
+        """
+        sample_billing_system.bill_cache_file = str(tmp_path / "bill_cache.json")
+        sample_billing_system.read_zone_map()
+        sample_billing_system.read_journey_data()
+        sample_billing_system.calculate_billing_amounts_per_user()
+
+        # All the bills should be read from the cache on the next run.
+        def fail_to_calculate_user_bill(journeys):
+            raise AssertionError("Bill should have been cached.")
+
+        monkeypatch.setattr(
+            MassTransitBillingSystem,
+            "calculate_user_bill",
+            staticmethod(fail_to_calculate_user_bill),
+        )
+        sample_billing_system.user_bills.clear()
+        sample_billing_system.calculate_billing_amounts_per_user()
+        assert dict(sample_billing_system.user_bills) == {
+            "user1": 690,
+            "user2": 330,
+            "user3": 780,
+        }
+
+    def test_calculate_billing_amounts_per_user_with_changed_journeys(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ):
+        """
+        Ensure that only the users whose journeys have changed since the bills
+        were cached are billed again.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the bill calculation.
+            tmp_path: A temporary directory for the bill cache.
+        """
+        sample_billing_system.bill_cache_file = str(tmp_path / "bill_cache.json")
+        sample_billing_system.read_zone_map()
+        sample_billing_system.read_journey_data()
+        sample_billing_system.calculate_billing_amounts_per_user()
+
+        # Add another OUT journey without a matching IN journey for user3,
+        # which should cost them another £5.
+        zones, is_in_flags, days = sample_billing_system.journeys_per_user["user3"]
+        zones.append(2)
+        is_in_flags.append(False)
+        days.append(date(2022, 4, 10).toordinal())
+
+        billed_journeys = []
+        calculate_user_bill = MassTransitBillingSystem.calculate_user_bill
+
+        def record_calculate_user_bill(journeys):
+            billed_journeys.append(journeys)
+            return calculate_user_bill(journeys)
+
+        monkeypatch.setattr(
+            MassTransitBillingSystem,
+            "calculate_user_bill",
+            staticmethod(record_calculate_user_bill),
+        )
+        sample_billing_system.user_bills.clear()
+        sample_billing_system.calculate_billing_amounts_per_user()
+        assert billed_journeys == [sample_billing_system.journeys_per_user["user3"]]
+        assert dict(sample_billing_system.user_bills) == {
+            "user1": 690,
+            "user2": 330,
+            "user3": 1280,
+        }
+
+    def test_read_bill_cache_corrupt(
+        self, sample_billing_system: MassTransitBillingSystem, tmp_path: Path
+    ):
+        """
+        Ensure that a bill cache which can't be decoded is treated as empty,
+        and is replaced by a valid cache once billing has finished.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            tmp_path: A temporary directory for the bill cache.
+        """
+        bill_cache_file = tmp_path / "bill_cache.json"
+        bill_cache_file.write_text("garbage{", encoding="utf-8")
+        sample_billing_system.bill_cache_file = str(bill_cache_file)
+        assert sample_billing_system.read_bill_cache() == {}
+
+        sample_billing_system.read_zone_map()
+        sample_billing_system.read_journey_data()
+        sample_billing_system.calculate_billing_amounts_per_user()
+        assert sorted(sample_billing_system.read_bill_cache().values()) == [
+            330,
+            690,
+            780,
+        ]
+        # Only the cache itself should be left, without any temporary files.
+        assert list(tmp_path.iterdir()) == [bill_cache_file]
+
+    def test_read_bill_cache_invalid_amounts(
+        self, sample_billing_system: MassTransitBillingSystem, tmp_path: Path
+    ):
+        """
+        Ensure that cached bills which aren't a whole number of pence are
+        dropped rather than reused.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            tmp_path: A temporary directory for the bill cache.
+        """
+        bill_cache_file = tmp_path / "bill_cache.json"
+        bill_cache_file.write_text(
+            '{"a": 690, "b": "330", "c": 7.8, "d": null, "e": true}',
+            encoding="utf-8",
+        )
+        sample_billing_system.bill_cache_file = str(bill_cache_file)
+        assert sample_billing_system.read_bill_cache() == {"a": 690}
+
+    def test_write_bill_cache_mode(
+        self, sample_billing_system: MassTransitBillingSystem, tmp_path: Path
+    ):
+        """
+        Ensure that writing the bill cache keeps the mode of an existing cache,
+        and gives a new cache the default mode for a new file.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            tmp_path: A temporary directory for the bill cache.
+        """
+        bill_cache_file = tmp_path / "bill_cache.json"
+        sample_billing_system.bill_cache_file = str(bill_cache_file)
+        umask = os.umask(0o022)
+        try:
+            sample_billing_system.write_bill_cache({})
+        finally:
+            os.umask(umask)
+        assert stat.S_IMODE(bill_cache_file.stat().st_mode) == 0o644
+
+        bill_cache_file.chmod(0o640)
+        sample_billing_system.write_bill_cache({})
+        assert stat.S_IMODE(bill_cache_file.stat().st_mode) == 0o640
+
     def test_write_billing_output(
         self, sample_billing_system: MassTransitBillingSystem
     ):
@@ -171,3 +647,58 @@ class TestMassTransitBillingSystem:
         assert output == (
             "user1,6.90\n" "user2,3.30\n" "user3,7.80\n"
         )
+
+    def test_process_billing_streaming(
+        self, sample_billing_system: MassTransitBillingSystem
+    ):
+        """
+        Ensure that the billing process produces the same output when the
+        journeys are processed one user at a time.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+        """
+        sample_billing_system.process_billing_streaming()
+        with open(
+            sample_billing_system.output_file, "r", encoding="utf-8"
+        ) as output_file:
+            output = output_file.read()
+        assert output == (
+            "user1,6.90\n" "user2,3.30\n" "user3,7.80\n"
+        )
+
+    def test_process_billing_streaming_with_bill_cache(
+        self,
+        sample_billing_system: MassTransitBillingSystem,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ):
+        """
+        Ensure that cached bills are reused when the journeys are processed
+        one user at a time.
+
+        Args:
+            sample_billing_system: A sample billing system object.
+            monkeypatch: A fixture for patching the bill calculation.
+            tmp_path: A temporary directory for the bill cache.
+        """
+        sample_billing_system.bill_cache_file = str(tmp_path / "bill_cache.json")
+        sample_billing_system.process_billing_streaming()
+
+        # All the bills should be read from the cache on the next run.
+        def fail_to_calculate_user_bill(journeys):
+            raise AssertionError("Bill should have been cached.")
+
+        monkeypatch.setattr(
+            MassTransitBillingSystem,
+            "calculate_user_bill",
+            staticmethod(fail_to_calculate_user_bill),
+        )
+        sample_billing_system.process_billing_streaming()
+        with open(
+            sample_billing_system.output_file, "r", encoding="utf-8"
+        ) as output_file:
+            output = output_file.read()
+        assert output == (
+            "user1,6.90\n" "user2,3.30\n" "user3,7.80\n"
+        )